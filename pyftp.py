@@ -10,14 +10,45 @@ __all__ = ['StatResult', 'PyFTP']
 
 import os
 import stat
+import zlib
+import numbers
 
 import ftplib
-from ftplib import FTP, error_perm, error_temp
+from ftplib import FTP, error_perm, error_temp, error_reply, error_proto
 
 import time
 from contextlib import contextmanager
 
 
+# file extensions which are already compressed, MODE Z gains nothing on them
+_COMPRESSED_EXTS = frozenset([
+    '.gz', '.tgz', '.bz2', '.tbz2', '.xz', '.txz', '.lzma', '.z', '.zip',
+    '.7z', '.rar', '.jar', '.war', '.apk', '.cab', '.zst',
+    '.jpg', '.jpeg', '.png', '.gif', '.webp',
+    '.mp3', '.mp4', '.m4a', '.mkv', '.avi', '.mov', '.ogg', '.flac',
+    '.pdf', '.docx', '.xlsx', '.pptx', '.odt', '.ods',
+    ])
+
+
+def _is_compressed(filename):
+    '''check whether the file looks already compressed by its extension'''
+    return os.path.splitext(filename)[1].lower() in _COMPRESSED_EXTS
+
+
+def _zlib_eof(decomp):
+    '''check if decompress object reached the end of the deflate stream'''
+    if hasattr(decomp, 'eof'):
+        return decomp.eof
+    # python 2 has no `eof`, feed one byte to a copy of the decompress object,
+    # it only lands in `unused_data` if the stream already ended
+    probe = decomp.copy()
+    try:
+        probe.decompress(b'\0')
+    except zlib.error:
+        return False
+    return probe.unused_data == b'\0'
+
+
 def ftp_host(address, port=None):
     '''extract protocol/host/port from input host string'''
     PORT_MAP = {'ftp': 21, 'sftp': 22}
@@ -113,16 +144,28 @@ class PyFTP(object):
     #__metaclass__ = type
     '''high-level FTP client library wrapper'''
 
-    def __init__(self, host, username='', password='', port=None):
+    def __init__(self, host, username='', password='', port=None,
+                 compress=False, compress_level=6):
+        if isinstance(compress_level, bool) \
+                or not isinstance(compress_level, numbers.Integral) \
+                or compress_level not in range(10):
+            raise ValueError("invalid compress level '{0}'".format(compress_level))
         self.host, self.port, self.type = ftp_host(host, port)
         self.user, self.pswd = username, password
-        self.ftp = FTP(self.host)
+        # only an explicit port is honored, the control connection is always ftp
+        self.ftp = FTP()
+        self.ftp.connect(self.host, port or 21)
         self._conn = False
+        # MODE Z (deflate) transfer, used only if server support it
+        self.compress = compress
+        self.compress_level = compress_level
+        self._mode_z = None
 
     def connect(self):
         '''connect to ftp server using give credential'''
         self.ftp.login(self.user, self.pswd)
         self._conn = True
+        self._mode_z = None
 
 
     def close(self):
@@ -224,6 +267,115 @@ class PyFTP(object):
         except error_perm as e:
             return False
     
+    def support_mode_z(self):
+        '''check if server support MODE Z (from FEAT response)'''
+        if self._mode_z is None:
+            try:
+                resp = self.ftp.sendcmd('FEAT')
+                feats = [l.strip().upper() for l in resp.splitlines()[1:-1]]
+                self._mode_z = 'MODE Z' in feats
+            except (error_perm, error_temp):
+                self._mode_z = False
+        return self._mode_z
+
+    @contextmanager
+    def mode_z(self, pathname):
+        '''switch to MODE Z for transfer of pathname with statement,
+        yield True if MODE Z is in use, False for plain stream mode
+        '''
+        if not self.compress or _is_compressed(pathname) \
+                or not self.support_mode_z():
+            yield False
+            return
+
+        try:
+            self.ftp.voidcmd('MODE Z')
+        except error_temp as e:
+            # temporary failure, stream mode for this transfer only
+            yield False
+            return
+        except (error_perm, error_reply) as e:
+            # advertised but refused, stay in stream mode from now on
+            self._mode_z = False
+            yield False
+            return
+
+        done = False
+        try:
+            try:
+                # server side compress level for downloads, optional
+                self.ftp.voidcmd('OPTS MODE Z LEVEL %d' % self.compress_level)
+            except (error_perm, error_temp, error_reply) as e:
+                pass
+            yield True
+            done = True
+        finally:
+            try:
+                self.ftp.voidcmd('MODE S')
+            except ftplib.all_errors:
+                # don't hide the transfer error behind this one
+                if done:
+                    raise
+
+    def _retr_z(self, cmd, callback, blocksize=8192):
+        '''retrieve a file in MODE Z, deliver decompressed data to callback'''
+        self.ftp.voidcmd('TYPE I')
+        decomp = zlib.decompressobj()
+        error = None
+        conn = self.ftp.transfercmd(cmd)
+        try:
+            while True:
+                data = conn.recv(blocksize)
+                if not data:
+                    break
+                if error:
+                    # drain the rest, so the server can finish the transfer
+                    continue
+                try:
+                    data = decomp.decompress(data)
+                except zlib.error as e:
+                    error = 'is corrupt ({0})'.format(e)
+                    continue
+                if data:
+                    callback(data)
+
+            if error:
+                pass
+            elif not _zlib_eof(decomp):
+                error = 'is truncated'
+            elif decomp.unused_data:
+                error = 'has trailing data'
+            else:
+                data = decomp.flush()
+                if data:
+                    callback(data)
+        finally:
+            conn.close()
+
+        # always read the transfer reply, keep the control connection in sync
+        resp = self.ftp.voidresp()
+        if error:
+            raise error_proto('MODE Z stream of {0} {1}'.format(cmd[5:], error))
+        return resp
+
+    def _stor_z(self, cmd, fp, blocksize=8192):
+        '''store a file in MODE Z, data read from fp is compressed on the fly'''
+        self.ftp.voidcmd('TYPE I')
+        comp = zlib.compressobj(self.compress_level)
+        conn = self.ftp.transfercmd(cmd)
+        try:
+            while True:
+                buf = fp.read(blocksize)
+                if not buf:
+                    break
+                data = comp.compress(buf)
+                if data:
+                    conn.sendall(data)
+            conn.sendall(comp.flush())
+        finally:
+            conn.close()
+        return self.ftp.voidresp()
+
     def get_mtime(self, remotepath):
         try:
             resp = self.ftp.sendcmd('MDTM %s' % remotepath)
@@ -420,6 +572,7 @@ class PyFTP(object):
             local file match the time on the remote. (st_atime can differ
             because stat'ing the localfile can/does update it's st_atime)
         :raises: IOError
+        :raises: error_proto if MODE Z stream is broken
         """
         if not localpath:
             localpath = os.path.split(remotepath)[1]
@@ -427,9 +580,17 @@ class PyFTP(object):
         if preserve_mtime:
             mtime = self.get_mtime(remotepath)
 
-        with open(localpath, 'wb') as f:
-            # actual get file content
-            self.ftp.retrbinary('RETR %s' % remotepath, f.write)
+        try:
+            with open(localpath, 'wb') as f, self.mode_z(remotepath) as zmode:
+                # actual get file content
+                if zmode:
+                    self._retr_z('RETR %s' % remotepath, f.write)
+                else:
+                    self.ftp.retrbinary('RETR %s' % remotepath, f.write)
+        except error_proto:
+            # never leave a truncated file behind
+            os.remove(localpath)
+            raise
 
         if preserve_mtime:
             os.utime(localpath, (mtime, mtime))
@@ -528,9 +689,12 @@ class PyFTP(object):
         if preserve_mtime:
             l_stat = os.stat(localpath)
 
-        with open(localpath, 'rb') as fp:
+        with open(localpath, 'rb') as fp, self.mode_z(localpath) as zmode:
             # actual upload file content
-            self.ftp.storbinary('STOR %s' % remotepath, fp)
+            if zmode:
+                self._stor_z('STOR %s' % remotepath, fp)
+            else:
+                self.ftp.storbinary('STOR %s' % remotepath, fp)
         
         if preserve_mtime:
             self.set_mtime(remotepath, l_stat.st_mtime)
@@ -0,0 +1,242 @@
+# coding: utf-8
+
+"""
+MODE Z tests against a local stand-in ftp server
+
+"""
+
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import unittest
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from ftplib import error_proto
+from pyftp import PyFTP
+
+
+class ModeZServer(object):
+    '''minimal single client ftp server, speaks just enough for get & put
+
+    :param bool feat_z: advertise `MODE Z` in FEAT response
+    :param str mode_z_resp: reply to `MODE Z` command
+    :param str opts_resp: reply to `OPTS MODE Z LEVEL` command
+    :param bool truncate: cut MODE Z download stream in half
+    :param bool corrupt: send garbage instead of MODE Z download stream
+    '''
+
+    def __init__(self, feat_z=True, mode_z_resp='200 MODE Z ok',
+                 opts_resp='200 ok', truncate=False, corrupt=False):
+        self.feat_z, self.mode_z_resp, self.opts_resp = feat_z, mode_z_resp, opts_resp
+        self.truncate, self.corrupt = truncate, corrupt
+        self.files = {}
+        self.log = []
+        self.wire = []
+        self.sock = socket.socket()
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(1)
+        self.port = self.sock.getsockname()[1]
+        self.thread = threading.Thread(target=self.serve)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def serve(self):
+        conn = self.sock.accept()[0]
+        fp = conn.makefile('rb')
+        send = lambda line: conn.sendall((line + '\r\n').encode('ascii'))
+        send('220 stand-in ready')
+        mode, level, pasv = 'S', 6, None
+        try:
+            while True:
+                line = fp.readline()
+                if not line:
+                    break
+                cmd = line.decode('ascii').strip()
+                self.log.append(cmd)
+                verb, _, arg = cmd.partition(' ')
+                verb = verb.upper()
+                if verb == 'USER':
+                    send('331 password please')
+                elif verb in ('PASS', 'TYPE'):
+                    send('200 ok')
+                elif verb == 'FEAT':
+                    send('211-Features:')
+                    send(' SIZE')
+                    if self.feat_z:
+                        send(' MODE Z')
+                    send('211 End')
+                elif verb == 'MODE' and arg.upper() == 'Z':
+                    send(self.mode_z_resp)
+                    if self.mode_z_resp[0] == '2':
+                        mode = 'Z'
+                elif verb == 'MODE':
+                    mode = 'S'
+                    send('200 ok')
+                elif verb == 'OPTS' and arg.upper().startswith('MODE Z LEVEL '):
+                    send(self.opts_resp)
+                    if self.opts_resp[0] == '2':
+                        level = int(arg.split()[-1])
+                elif verb == 'PASV':
+                    pasv = socket.socket()
+                    pasv.bind(('127.0.0.1', 0))
+                    pasv.listen(1)
+                    port = pasv.getsockname()[1]
+                    send('227 Entering Passive Mode (127,0,0,1,%d,%d)' % (port >> 8, port & 0xff))
+                elif verb in ('RETR', 'STOR'):
+                    send('150 data connection open')
+                    data_conn = pasv.accept()[0]
+                    pasv.close()
+                    if verb == 'RETR':
+                        data = self.files[arg]
+                        if mode == 'Z':
+                            data = zlib.compress(data, level)
+                            if self.truncate:
+                                data = data[:len(data) // 2]
+                            if self.corrupt:
+                                data = b'\xff' * len(data)
+                        self.wire.append(len(data))
+                        data_conn.sendall(data)
+                    else:
+                        chunks = []
+                        while True:
+                            buf = data_conn.recv(65536)
+                            if not buf:
+                                break
+                            chunks.append(buf)
+                        data = b''.join(chunks)
+                        self.wire.append(len(data))
+                        self.files[arg] = zlib.decompress(data) if mode == 'Z' else data
+                    data_conn.close()
+                    send('226 transfer complete')
+                elif verb == 'QUIT':
+                    send('221 bye')
+                    break
+                else:
+                    send('502 not implemented')
+        finally:
+            conn.close()
+            self.sock.close()
+
+
+class ModeZTest(unittest.TestCase):
+
+    DATA = b'\n'.join(b'2016-01-01,host,GET /index.html,200,' + str(i).encode('ascii')
+                      for i in range(20000))
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def client(self, server, **kwargs):
+        ftp = PyFTP('127.0.0.1', 'user', 'pass', port=server.port, compress=True, **kwargs)
+        ftp.connect()
+        self.addCleanup(ftp.close)
+        return ftp
+
+    def local(self, name, data=None):
+        path = os.path.join(self.tmpdir, name)
+        if data is not None:
+            with open(path, 'wb') as f:
+                f.write(data)
+        return path
+
+    def read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_round_trip(self):
+        server = ModeZServer()
+        ftp = self.client(server, compress_level=9)
+        ftp.put(self.local('a.csv', self.DATA), 'a.csv')
+        ftp.get('a.csv', self.local('b.csv'))
+
+        self.assertEqual(server.files['a.csv'], self.DATA)
+        self.assertEqual(self.read(self.local('b.csv')), self.DATA)
+        self.assertTrue(all(n < len(self.DATA) // 5 for n in server.wire))
+        self.assertEqual(server.log.count('MODE Z'), 2)
+        self.assertEqual(server.log.count('MODE S'), 2)
+        self.assertIn('OPTS MODE Z LEVEL 9', server.log)
+
+    def test_not_advertised(self):
+        server = ModeZServer(feat_z=False)
+        ftp = self.client(server)
+        ftp.put(self.local('a.csv', self.DATA), 'a.csv')
+        ftp.get('a.csv', self.local('b.csv'))
+
+        self.assertEqual(self.read(self.local('b.csv')), self.DATA)
+        self.assertEqual(server.wire, [len(self.DATA)] * 2)
+        self.assertNotIn('MODE Z', server.log)
+        self.assertEqual(server.log.count('FEAT'), 1)
+
+    def test_refused(self):
+        for resp in ('504 MODE Z not supported', '421 try again later'):
+            server = ModeZServer(mode_z_resp=resp)
+            ftp = self.client(server)
+            ftp.put(self.local('a.csv', self.DATA), 'a.csv')
+
+            self.assertEqual(server.files['a.csv'], self.DATA)
+            self.assertEqual(server.wire, [len(self.DATA)])
+            self.assertNotIn('MODE S', server.log)
+
+    def test_opts_refused(self):
+        for resp in ('501 unknown option', '450 try again later'):
+            server = ModeZServer(opts_resp=resp)
+            ftp = self.client(server)
+            ftp.put(self.local('a.csv', self.DATA), 'a.csv')
+            ftp.put(self.local('a.gz', self.DATA), 'a.gz')
+
+            self.assertEqual(server.files['a.csv'], self.DATA)
+            self.assertEqual(server.files['a.gz'], self.DATA)
+            self.assertEqual(server.wire[1], len(self.DATA))
+            self.assertEqual(server.log.count('MODE S'), 1)
+
+    def test_skip_compressed(self):
+        server = ModeZServer()
+        ftp = self.client(server)
+        ftp.put(self.local('a.gz', self.DATA), 'a.gz')
+        ftp.get('a.gz', self.local('b.gz'))
+
+        self.assertEqual(self.read(self.local('b.gz')), self.DATA)
+        self.assertEqual(server.wire, [len(self.DATA)] * 2)
+        self.assertNotIn('MODE Z', server.log)
+
+    def test_truncated(self):
+        server = ModeZServer(truncate=True)
+        server.files['a.csv'] = self.DATA
+        ftp = self.client(server)
+
+        self.assertRaises(error_proto, ftp.get, 'a.csv', self.local('b.csv'))
+        self.assertFalse(os.path.exists(self.local('b.csv')))
+        self.assertEqual(server.log[-1], 'MODE S')
+
+        # control connection still in sync
+        ftp.put(self.local('c.gz', self.DATA), 'c.gz')
+        self.assertEqual(server.files['c.gz'], self.DATA)
+
+    def test_corrupt(self):
+        server = ModeZServer(corrupt=True)
+        server.files['a.csv'] = self.DATA
+        ftp = self.client(server)
+
+        self.assertRaises(error_proto, ftp.get, 'a.csv', self.local('b.csv'))
+        self.assertFalse(os.path.exists(self.local('b.csv')))
+        self.assertEqual(server.log[-1], 'MODE S')
+
+        # control connection still in sync
+        ftp.put(self.local('c.gz', self.DATA), 'c.gz')
+        self.assertEqual(server.files['c.gz'], self.DATA)
+
+    def test_invalid_level(self):
+        for level in (10, -1, True, 6.0, '6'):
+            self.assertRaises(ValueError, PyFTP, '127.0.0.1', compress_level=level)
+
+
+if __name__ == '__main__':
+    unittest.main()